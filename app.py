@@ -1,20 +1,105 @@
 from dotenv import load_dotenv
 load_dotenv()
+import os
+_GEMINI_KEY_PRESENT = bool(os.environ.get("GEMINI_API_KEY"))
 import streamlit as st
 import pandas as pd
 import json
-import os
 from pathlib import Path
 import sys
-import time
 import io
+import shutil
+import tempfile
 import zipfile
+import queue
+import asyncio
+import threading
+import chromadb.errors
+
+try:
+    import orjson  # Optional: faster JSON encoding for downloads
+except ImportError:
+    orjson = None
 
 sys.path.append(str(Path(__file__).parent))
 
+# The SentenceTransformer embedder runs on torch. Keep intra-op work single-threaded so
+# concurrent embed calls (reruns, parallel script generation) spread across cores
+# instead of contending for the same ones.
+import torch
+torch.set_num_threads(1)
+
 from backend.ingest import DocumentIngestion
-from backend.rag import RAGEngine
+from backend.rag import RAGEngine, TEST_CASE_DOC_TYPES
 from backend.script_generation import SeleniumScriptGenerator
+from backend._shared import get_chroma_client, COLLECTION_NAME
+
+# Gemini free tier quota (requests per minute)
+GEMINI_RPM = 15
+# Script generation requests kept in flight at once
+GEMINI_CONCURRENCY = 4
+# Rough Gemini response time for one script (seconds), used for the generation time estimate
+GEMINI_SECONDS_PER_SCRIPT = 10
+
+PERSIST_DIR = "./db"
+
+# Raised by delete_collection for a missing collection (the type differs across Chroma versions)
+_MISSING_COLLECTION_ERRORS = tuple(
+    getattr(chromadb.errors, name)
+    for name in ("NotFoundError", "InvalidCollectionException")
+    if hasattr(chromadb.errors, name)
+) + (ValueError,)
+
+
+# Cached so the embedding model and Chroma client are loaded once per process
+@st.cache_resource
+def get_ingestion(persist_dir=PERSIST_DIR):
+    return DocumentIngestion(persist_directory=persist_dir)
+
+
+@st.cache_resource
+def get_rag_engine(persist_dir=PERSIST_DIR):
+    return RAGEngine(persist_directory=persist_dir)
+
+
+@st.cache_resource
+def get_script_generator(persist_dir=PERSIST_DIR):
+    return SeleniumScriptGenerator(persist_directory=persist_dir)
+
+
+@st.cache_resource
+def get_event_loop():
+    """
+    One long-lived asyncio loop on a background thread, shared by every Generate click.
+    Gemini's grpc_asyncio client is bound to the loop it was first used on, so a fresh
+    asyncio.run() per click would break every batch after the first.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="quantumqa-gemini-loop", daemon=True)
+    thread.start()
+    return loop
+
+
+@st.cache_resource
+def _start_warmup():
+    """
+    Load the engines (and their embedding models) in a background thread, once per process,
+    so the first Build / Generate click doesn't pay the model cold start.
+    """
+    def _warm():
+        get_ingestion()
+        get_rag_engine()
+        get_script_generator()
+    
+    thread = threading.Thread(target=_warm, name="quantumqa-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def clear_engine_caches():
+    """Drop cached engines that hold a handle to the (now replaced) collection."""
+    get_rag_engine.clear()
+    get_script_generator.clear()
 
 
 st.set_page_config(
@@ -24,7 +109,7 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-st.markdown("""
+_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -78,7 +163,13 @@ st.markdown("""
         background-color: #2980b9;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+@st.cache_resource
+def _css_once():
+    return _CSS
+
 
 # Session state initialization
 if 'kb_built' not in st.session_state:
@@ -87,13 +178,63 @@ if 'test_cases' not in st.session_state:
     st.session_state.test_cases = []
 if 'selected_test_cases' not in st.session_state:  # Changed to plural
     st.session_state.selected_test_cases = []
+if 'selected_test_case_ids' not in st.session_state:  # Mirrors selected_test_cases for O(1) lookups
+    st.session_state.selected_test_case_ids = set()
 if 'generated_scripts' not in st.session_state:  # Changed to plural
     st.session_state.generated_scripts = {}
 if 'uploaded_files_data' not in st.session_state:
     st.session_state.uploaded_files_data = []
+if 'open_expander_idx' not in st.session_state:  # Only this test case renders its full details
+    st.session_state.open_expander_idx = 0
+
+# Spawned parse workers re-import this script as __mp_main__; they must not load the engines
+if __name__ != "__mp_main__":
+    _start_warmup()
+
+
+TC_TABLE_COLUMNS = ['Selected', 'Test_ID', 'Feature', 'Scenario', 'Expected_Result', 'Grounded_In']
+
+
+def _freeze_tc(tc):
+    """Convert a test case dict into a hashable tuple of (key, value) pairs."""
+    return tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in tc.items())
+
+
+@st.cache_data
+def _tc_json_bytes(test_cases_tuple):
+    """Serialize test cases for the JSON download; cached so reruns skip re-encoding."""
+    test_cases = [dict(frozen_tc) for frozen_tc in test_cases_tuple]
+    if orjson is not None:
+        return orjson.dumps(test_cases, option=orjson.OPT_INDENT_2)
+    return json.dumps(test_cases, indent=2).encode("utf-8")
+
+
+@st.cache_data
+def _build_scripts_zip(scripts_items):
+    """
+    Bundle (tc_id, script) pairs into a ZIP archive and return its bytes.
+    Scripts are small .py sources, so entries are stored without compression.
+    """
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        for tc_id, script in scripts_items:
+            zip_file.writestr(f"{tc_id}_selenium.py", script)
+    return zip_buffer.getvalue()
+
+
+def _spill_upload(uploaded_file, upload_dir, idx):
+    """
+    Write an uploaded file into upload_dir and return its path, so ingestion reads
+    it from disk instead of holding the bytes. The index prefix keeps uploads that
+    share a name from overwriting each other.
+    """
+    dest = Path(upload_dir) / f"{idx}_{Path(uploaded_file.name).name}"
+    dest.write_bytes(uploaded_file.getbuffer())  # getbuffer() avoids the copy made by read()
+    return str(dest)
 
 
 def main():
+    st.html(_css_once())
     st.markdown('<div class="main-header">🤖 QuantumQA - Autonomous QA Agent</div>', unsafe_allow_html=True)
     st.markdown("**Documentation-Grounded Test Case & Selenium Script Generation**")
     
@@ -203,60 +344,80 @@ def render_phase_1():
     
     if reset_button:
         try:
-            from chromadb import PersistentClient
-            client = PersistentClient(path="./db")
+            client = get_chroma_client(PERSIST_DIR)
             try:
-                client.delete_collection("qa_knowledge_base")
+                client.delete_collection(COLLECTION_NAME)
                 st.session_state.kb_built = False
                 st.session_state.test_cases = []
                 st.session_state.selected_test_cases = []  # Reset multi-select
+                st.session_state.selected_test_case_ids = set()
+                _reset_selection_checkboxes()
                 st.session_state.generated_scripts = {}  # Reset scripts
+                st.session_state.uploaded_files_data = []
+                get_ingestion.clear()
+                clear_engine_caches()
                 st.success("✅ Knowledge Base reset successfully!")
-            except:
+            except _MISSING_COLLECTION_ERRORS:
                 st.warning("⚠️ Knowledge Base was already empty")
         except Exception as e:
             st.error(f"❌ Error resetting KB: {str(e)}")
     
     if build_button:
         files_to_process = []
+        uploads = []
         
         if st.session_state.get('use_sample_files', False):
-            sample_dir = Path("assets")
-            if sample_dir.exists():
-                for file_path in sample_dir.glob("*"):
-                    if file_path.is_file():
-                        with open(file_path, 'rb') as f:
-                            files_to_process.append((str(file_path), f.read(), file_path.name))
+            sample_dir = "assets"
+            if os.path.isdir(sample_dir):
+                # DirEntry caches is_file(), so this avoids a stat per file;
+                # content is read by the ingestion step from the path
+                with os.scandir(sample_dir) as entries:
+                    files_to_process.extend(
+                        (entry.path, None, entry.name) for entry in entries if entry.is_file()
+                    )
         else:
-            if support_docs:
-                for doc in support_docs:
-                    files_to_process.append((doc.name, doc.read(), doc.name))
-            
+            uploads = list(support_docs or [])
             if html_file:
-                files_to_process.append((html_file.name, html_file.read(), html_file.name))
+                uploads.append(html_file)
         
-        if not files_to_process:
+        if not files_to_process and not uploads:
             st.error("❌ Please upload at least one file or use sample files")
             return
         
-        st.session_state.uploaded_files_data = files_to_process
+        # Only the names: spilled upload paths are deleted when the build ends
+        st.session_state.uploaded_files_data = (
+            [filename for _, _, filename in files_to_process] + [upload.name for upload in uploads]
+        )
         
+        upload_dir = None
         with st.spinner("🔄 Building Knowledge Base..."):
             try:
+                if uploads:
+                    # Spilled only for this build; the finally below removes them
+                    upload_dir = tempfile.mkdtemp(prefix="quantumqa_")
+                    files_to_process = [
+                        (_spill_upload(upload, upload_dir, idx), None, upload.name)
+                        for idx, upload in enumerate(uploads)
+                    ]
+                
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
                 status_text.text("Initializing ingestion engine...")
                 progress_bar.progress(10)
                 
-                ingestion = DocumentIngestion(persist_directory="./db", reset=True)
+                ingestion = get_ingestion()
+                clear_engine_caches()
                 
                 status_text.text(f"Processing {len(files_to_process)} files...")
                 progress_bar.progress(30)
                 
-                stats = ingestion.ingest_documents(files_to_process)
+                def on_batch_stored(stored, total):
+                    status_text.text(f"Generating embeddings and storing in ChromaDB... ({stored}/{total} chunks)")
+                    progress_bar.progress(int((stored / total) * 50) + 30)
                 
-                status_text.text("Generating embeddings and storing in ChromaDB...")
+                # Unchanged files are reused; files no longer uploaded are pruned
+                stats = ingestion.ingest_documents(files_to_process, progress_callback=on_batch_stored, prune=True)
                 progress_bar.progress(80)
                 
                 st.session_state.kb_built = True
@@ -291,12 +452,15 @@ def render_phase_1():
                 st.error(f"❌ Error building knowledge base: {str(e)}")
                 import traceback
                 st.code(traceback.format_exc())
+            finally:
+                if upload_dir:
+                    shutil.rmtree(upload_dir, ignore_errors=True)
 
 
 def render_phase_2():
     st.markdown('<div class="section-header">Phase 2: Test Case Generation</div>', unsafe_allow_html=True)
     
-    if not os.environ.get("GEMINI_API_KEY"):
+    if not _GEMINI_KEY_PRESENT:
         st.markdown('<div class="warning-box">', unsafe_allow_html=True)
         st.markdown("### ⚠️ Gemini API Key Not Found")
         st.markdown("Please set the GEMINI_API_KEY environment variable to use AI-powered test case generation.")
@@ -353,12 +517,12 @@ def render_phase_2():
                 status_text.text("Initializing RAG engine...")
                 progress_bar.progress(20)
                 
-                rag_engine = RAGEngine(persist_directory="./db")
+                rag_engine = get_rag_engine()
                 
                 status_text.text("Retrieving relevant documentation...")
                 progress_bar.progress(40)
                 
-                retrieved_chunks = rag_engine.retrieve_context(user_query, top_k=6)
+                retrieved_chunks = rag_engine.retrieve_context(user_query, top_k=6, doc_types=TEST_CASE_DOC_TYPES)
                 
                 status_text.text(f"Retrieved {len(retrieved_chunks)} relevant chunks. Generating test cases...")
                 progress_bar.progress(60)
@@ -366,6 +530,8 @@ def render_phase_2():
                 test_cases = rag_engine.generate_test_cases(user_query, retrieved_chunks)
                 
                 st.session_state.test_cases = test_cases
+                st.session_state.open_expander_idx = 0
+                _reset_selection_checkboxes()
                 
                 progress_bar.progress(100)
                 status_text.text("✅ Test cases generated successfully!")
@@ -387,24 +553,96 @@ def render_phase_2():
         with col_sel1:
             if st.button("✅ Select All", use_container_width=True):
                 st.session_state.selected_test_cases = st.session_state.test_cases.copy()
+                st.session_state.selected_test_case_ids = {
+                    tc.get('Test_ID', f'tc_{idx}') for idx, tc in enumerate(st.session_state.test_cases)
+                }
+                _reset_selection_checkboxes()
                 st.rerun()
         with col_sel2:
             if st.button("❌ Deselect All", use_container_width=True):
                 st.session_state.selected_test_cases = []
+                st.session_state.selected_test_case_ids = set()
+                _reset_selection_checkboxes()
                 st.rerun()
         
-        st.markdown("### 📋 Generated Test Cases")
+        _test_case_selector()
+        
+        st.download_button(
+            label="📥 Download Test Cases (JSON)",
+            data=_tc_json_bytes(tuple(map(_freeze_tc, st.session_state.test_cases))),
+            file_name="test_cases.json",
+            mime="application/json"
+        )
+
+
+def _reset_selection_checkboxes():
+    """
+    Drop the select_{idx} checkbox states after the selection or test case list changes.
+    Keyed checkboxes ignore value= once they have state; without it they re-read the selection.
+    """
+    for key in [key for key in st.session_state if str(key).startswith("select_")]:
+        del st.session_state[key]
+
+
+def _open_details(idx):
+    """Button callback: show the full details of test case `idx`."""
+    st.session_state.open_expander_idx = idx
+
+
+def _toggle_selection(tc, tc_id, widget_key):
+    """Checkbox callback: sync the selected list and ID set with the checkbox state."""
+    if st.session_state[widget_key]:
+        if tc_id not in st.session_state.selected_test_case_ids:
+            st.session_state.selected_test_cases.append(tc)
+            st.session_state.selected_test_case_ids.add(tc_id)
+    else:
+        st.session_state.selected_test_cases = [
+            t for t in st.session_state.selected_test_cases
+            if t.get('Test_ID') != tc_id
+        ]
+        st.session_state.selected_test_case_ids.discard(tc_id)
+    # The sidebar and Phase 3 read the selection outside the fragment; st.rerun is a no-op
+    # inside callbacks, so the fragment body starts a full rerun instead
+    st.session_state.selection_changed = True
+
+
+@st.fragment
+def _test_case_selector():
+    """
+    Test case cards, selection summary and table.
+    Runs as a fragment so a "Show details" click only reruns this block;
+    selection changes rerun the whole app.
+    """
+    if st.session_state.pop('selection_changed', False):
+        st.rerun(scope="app")
+    
+    st.markdown("### 📋 Generated Test Cases")
+    
+    # Table rows are collected while rendering the cards to avoid a second pass
+    df_records = []
+    for idx, tc in enumerate(st.session_state.test_cases):
+        tc_id = tc.get('Test_ID', f'tc_{idx}')
+        is_selected = tc_id in st.session_state.selected_test_case_ids
+        grounded_in = tc.get('Grounded_In', [])
+        df_records.append({
+            'Selected': '✅' if is_selected else '⬜',
+            'Test_ID': tc_id,
+            'Feature': tc.get('Feature', 'N/A'),
+            'Scenario': tc.get('Test_Scenario', 'N/A'),
+            'Expected_Result': tc.get('Expected_Result', 'N/A'),
+            'Grounded_In': ', '.join(grounded_in)
+        })
+        
+        is_open = (idx == st.session_state.open_expander_idx)
         
-        for idx, tc in enumerate(st.session_state.test_cases):
-            tc_id = tc.get('Test_ID', f'tc_{idx}')
-            is_selected = any(t.get('Test_ID') == tc_id for t in st.session_state.selected_test_cases)
+        with st.expander(f"**{tc_id}** - {tc.get('Feature', 'Unknown Feature')}", expanded=is_open):
+            col1, col2 = st.columns([3, 1])
             
-            with st.expander(f"**{tc_id}** - {tc.get('Feature', 'Unknown Feature')}", expanded=(idx==0)):
-                col1, col2 = st.columns([3, 1])
+            with col1:
+                st.markdown(f"**Test Scenario:** {tc.get('Test_Scenario', 'N/A')}")
                 
-                with col1:
-                    st.markdown(f"**Test Scenario:** {tc.get('Test_Scenario', 'N/A')}")
-                    
+                # Closed expanders still send their content, so only the open one renders details
+                if is_open:
                     st.markdown("**Steps:**")
                     steps = tc.get('Steps', [])
                     if isinstance(steps, list):
@@ -415,67 +653,62 @@ def render_phase_2():
                     
                     st.markdown(f"**Expected Result:** {tc.get('Expected_Result', 'N/A')}")
                     
-                    grounded_in = tc.get('Grounded_In', [])
                     if grounded_in:
                         st.markdown("**📚 Grounded In:**")
                         st.markdown(", ".join(grounded_in))
-                
-                with col2:
-                    # Checkbox for selection
-                    checkbox_label = "✅ Selected" if is_selected else "Select"
-                    if st.checkbox(checkbox_label, value=is_selected, key=f"select_{idx}"):
-                        if not is_selected:
-                            st.session_state.selected_test_cases.append(tc)
-                            st.rerun()
-                    else:
-                        if is_selected:
-                            st.session_state.selected_test_cases = [
-                                t for t in st.session_state.selected_test_cases 
-                                if t.get('Test_ID') != tc_id
-                            ]
-                            st.rerun()
-        
-        # Show selection summary
-        if st.session_state.selected_test_cases:
-            st.markdown("---")
-            st.markdown('<div class="success-box">', unsafe_allow_html=True)
-            st.markdown(f"### ✅ {len(st.session_state.selected_test_cases)} Test Case(s) Selected for Script Generation")
-            selected_ids = [tc.get('Test_ID', 'N/A') for tc in st.session_state.selected_test_cases]
-            st.markdown("**Selected:** " + ", ".join(selected_ids))
-            st.markdown("</div>", unsafe_allow_html=True)
-        
+                else:
+                    st.button("🔍 Show details", key=f"details_{idx}", on_click=_open_details, args=(idx,))
+            
+            with col2:
+                # Checkbox for selection
+                checkbox_label = "✅ Selected" if is_selected else "Select"
+                select_key = f"select_{idx}"
+                st.checkbox(
+                    checkbox_label,
+                    value=is_selected,
+                    key=select_key,
+                    on_change=_toggle_selection,
+                    args=(tc, tc_id, select_key)
+                )
+    
+    # Show selection summary
+    if st.session_state.selected_test_cases:
         st.markdown("---")
-        st.markdown("### 📊 Test Cases Table")
-        
-        df_data = []
-        for tc in st.session_state.test_cases:
-            tc_id = tc.get('Test_ID', 'N/A')
-            is_selected = any(t.get('Test_ID') == tc_id for t in st.session_state.selected_test_cases)
-            steps_str = ", ".join(tc.get('Steps', [])) if isinstance(tc.get('Steps'), list) else str(tc.get('Steps', ''))
-            df_data.append({
-                'Selected': '✅' if is_selected else '⬜',
-                'Test_ID': tc_id,
-                'Feature': tc.get('Feature', 'N/A'),
-                'Scenario': tc.get('Test_Scenario', 'N/A'),
-                'Expected_Result': tc.get('Expected_Result', 'N/A'),
-                'Grounded_In': ', '.join(tc.get('Grounded_In', []))
-            })
-        
-        df = pd.DataFrame(df_data)
-        st.dataframe(df, use_container_width=True)
-        
-        st.download_button(
-            label="📥 Download Test Cases (JSON)",
-            data=json.dumps(st.session_state.test_cases, indent=2),
-            file_name="test_cases.json",
-            mime="application/json"
-        )
+        st.markdown('<div class="success-box">', unsafe_allow_html=True)
+        st.markdown(f"### ✅ {len(st.session_state.selected_test_cases)} Test Case(s) Selected for Script Generation")
+        selected_ids = [tc.get('Test_ID', 'N/A') for tc in st.session_state.selected_test_cases]
+        st.markdown("**Selected:** " + ", ".join(selected_ids))
+        st.markdown("</div>", unsafe_allow_html=True)
+    
+    st.markdown("---")
+    st.markdown("### 📊 Test Cases Table")
+    
+    df = pd.DataFrame.from_records(df_records, columns=TC_TABLE_COLUMNS)
+    st.dataframe(df, use_container_width=True)
+
+
+@st.fragment
+def _generated_scripts_list():
+    """Per-script viewers and downloads; a fragment so download clicks don't rerun the page."""
+    # Individual script expanders
+    for tc_id, script in st.session_state.generated_scripts.items():
+        with st.expander(f"📄 Script for {tc_id}", expanded=False):
+            st.code(script, language="python", line_numbers=True)
+            
+            st.download_button(
+                label=f"📥 Download {tc_id}.py",
+                data=script,
+                file_name=f"{tc_id}_selenium.py",
+                mime="text/x-python",
+                key=f"download_{tc_id}",
+                use_container_width=True
+            )
 
 
 def render_phase_3():
     st.markdown('<div class="section-header">Phase 3: Selenium Script Generation</div>', unsafe_allow_html=True)
     
-    if not os.environ.get("GEMINI_API_KEY"):
+    if not _GEMINI_KEY_PRESENT:
         st.markdown('<div class="warning-box">', unsafe_allow_html=True)
         st.markdown("### ⚠️ Gemini API Key Not Found")
         st.markdown("Please set the GEMINI_API_KEY environment variable to use AI-powered script generation.")
@@ -500,8 +733,13 @@ def render_phase_3():
     
     # Estimate API usage
     total_cases = len(st.session_state.selected_test_cases)
-    estimated_time = total_cases * 4  # 4 seconds per request
-    st.info(f"⏱️ Estimated generation time: ~{estimated_time} seconds ({total_cases} test case(s) × 4 sec/case)")
+    # Requests start 60 / GEMINI_RPM seconds apart and at most GEMINI_CONCURRENCY are in flight;
+    # the last one to start is delayed by whichever is slower, then takes one response time
+    spacing_delay = (total_cases - 1) * 60 / GEMINI_RPM
+    concurrency_delay = (-(-total_cases // GEMINI_CONCURRENCY) - 1) * GEMINI_SECONDS_PER_SCRIPT
+    estimated_time = int(max(spacing_delay, concurrency_delay) + GEMINI_SECONDS_PER_SCRIPT)
+    st.info(f"⏱️ Estimated generation time: ~{estimated_time} seconds ({total_cases} test case(s), "
+            f"{GEMINI_CONCURRENCY} at a time, at most {GEMINI_RPM} requests/min)")
     
     col1, col2 = st.columns([1, 1])
     
@@ -515,31 +753,36 @@ def render_phase_3():
                     status_text.text("Initializing script generator...")
                     progress_bar.progress(5)
                     
-                    script_gen = SeleniumScriptGenerator(persist_directory="./db")
+                    script_gen = get_script_generator()
                     generated_scripts = {}
                     
-                    total_cases = len(st.session_state.selected_test_cases)
+                    selected = st.session_state.selected_test_cases
+                    total_cases = len(selected)
+                    status_text.text(f"Generating {total_cases} script(s), {GEMINI_CONCURRENCY} at a time...")
+                    
+                    # The batch runs on the background loop's thread, which can't touch Streamlit
+                    # elements, so completions are queued and the progress is drawn from here
+                    completions = queue.Queue()
+                    future = asyncio.run_coroutine_threadsafe(script_gen.generate_scripts_batch(
+                        selected, concurrency=GEMINI_CONCURRENCY,
+                        on_complete=lambda completed, tc_id: completions.put((completed, tc_id)),
+                        rpm=GEMINI_RPM
+                    ), get_event_loop())
                     
-                    for idx, tc in enumerate(st.session_state.selected_test_cases):
-                        tc_id = tc.get('Test_ID', f'test_{idx}')
-                        
-                        status_text.text(f"Generating script {idx + 1}/{total_cases}: {tc_id}...")
-                        
+                    while not future.done() or not completions.empty():
                         try:
-                            script = script_gen.generate_script(tc)
-                            generated_scripts[tc_id] = script
-                            
-                            progress = int(((idx + 1) / total_cases) * 95)
-                            progress_bar.progress(progress)
-                            
-                            # Rate limiting: wait 4 seconds between requests (15 RPM = 1 request per 4 seconds)
-                            if idx < total_cases - 1:
-                                status_text.text(f"Rate limiting... waiting 4 seconds before next request...")
-                                time.sleep(4)
-                        
-                        except Exception as e:
-                            st.warning(f"⚠️ Failed to generate script for {tc_id}: {str(e)}")
-                            generated_scripts[tc_id] = f"# Error generating script for {tc_id}\n# {str(e)}"
+                            completed, tc_id = completions.get(timeout=0.2)
+                        except queue.Empty:
+                            continue
+                        progress_bar.progress(int((completed / total_cases) * 95))
+                        status_text.text(f"Generated script {completed}/{total_cases}: {tc_id}")
+                    results = future.result()
+                    
+                    for tc_id, script, error in results:
+                        if error is not None:
+                            st.warning(f"⚠️ Failed to generate script for {tc_id}: {str(error)}")
+                            script = f"# Error generating script for {tc_id}\n# {str(error)}"
+                        generated_scripts[tc_id] = script
                     
                     st.session_state.generated_scripts = generated_scripts
                     
@@ -574,19 +817,7 @@ def render_phase_3():
         st.markdown("- ✓ Proper error handling")
         st.markdown("</div>", unsafe_allow_html=True)
         
-        # Individual script expanders
-        for tc_id, script in st.session_state.generated_scripts.items():
-            with st.expander(f"📄 Script for {tc_id}", expanded=False):
-                st.code(script, language="python", line_numbers=True)
-                
-                st.download_button(
-                    label=f"📥 Download {tc_id}.py",
-                    data=script,
-                    file_name=f"{tc_id}_selenium.py",
-                    mime="text/x-python",
-                    key=f"download_{tc_id}",
-                    use_container_width=True
-                )
+        _generated_scripts_list()
         
         # Download all as ZIP
         st.markdown("---")
@@ -595,15 +826,11 @@ def render_phase_3():
         col_zip1, col_zip2 = st.columns([1, 2])
         
         with col_zip1:
-            # Create ZIP file
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for tc_id, script in st.session_state.generated_scripts.items():
-                    zip_file.writestr(f"{tc_id}_selenium.py", script)
+            zip_bytes = _build_scripts_zip(tuple(sorted(st.session_state.generated_scripts.items())))
             
             st.download_button(
                 label="📦 Download All Scripts as ZIP",
-                data=zip_buffer.getvalue(),
+                data=zip_bytes,
                 file_name="selenium_scripts.zip",
                 mime="application/zip",
                 use_container_width=True
@@ -0,0 +1,98 @@
+import os
+import logging
+import functools
+import threading
+import torch
+import chromadb
+import google.generativeai as genai
+from sentence_transformers import SentenceTransformer
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+COLLECTION_NAME = 'qa_knowledge_base'
+
+logger = logging.getLogger(__name__)
+
+
+def _locked_cache(factory):
+    """
+    Cache factory(*args) per argument tuple, like functools.lru_cache(maxsize=None),
+    but concurrent first calls wait for one build instead of each loading their own.
+    """
+    cache = {}
+    lock = threading.Lock()
+    
+    @functools.wraps(factory)
+    def wrapper(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            pass
+        with lock:
+            if args not in cache:
+                cache[args] = factory(*args)
+            return cache[args]
+    
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
+def load_embedder() -> SentenceTransformer:
+    """
+    Load the sentence embedding model.
+    On GPU the weights are cast to fp16; on CPU they stay fp32, since reduced
+    precision there is usually slower without dedicated matmul support.
+    """
+    if torch.cuda.is_available():
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cuda')
+        model.half()
+    else:
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
+    return model
+
+
+@_locked_cache
+def get_embedder() -> SentenceTransformer:
+    """Process-wide embedding model shared by ingestion, RAG and script generation."""
+    return load_embedder()
+
+
+def tune_sqlite_writes(client) -> None:
+    """
+    Best-effort: put Chroma's SQLite store in WAL mode with synchronous=NORMAL,
+    so each batched add commits without a full fsync. journal_mode sticks to the
+    database file, but synchronous is per connection and Chroma pools one
+    connection per thread, so call this from the thread that does the writes.
+    This reaches into Chroma internals; on failure the defaults are left in place.
+    """
+    try:
+        from chromadb.db.impl.sqlite import SqliteDB
+        pool = client._system.instance(SqliteDB)._conn_pool
+        conn = pool.connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        finally:
+            pool.return_to_pool(conn)
+    except Exception as e:
+        logger.warning("Could not tune Chroma's SQLite connection, keeping defaults: %s", e)
+
+
+@_locked_cache
+def get_chroma_client(path: str):
+    """Process-wide Chroma client per persist directory."""
+    return chromadb.PersistentClient(path=path)
+
+
+def open_collection(client):
+    """Get or create the knowledge base collection (cosine HNSW space)."""
+    return client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        metadata={"hnsw:space": "cosine"}
+    )
+
+
+@_locked_cache
+def get_gemini():
+    """Configure the Gemini client once per process and return the genai module."""
+    genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+    return genai
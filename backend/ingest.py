@@ -1,54 +1,98 @@
 import os
 import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import markdown
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional, Callable
 from pathlib import Path
 import fitz
 from bs4 import BeautifulSoup
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
+import numpy as np
 
+from backend._shared import get_embedder, get_chroma_client, open_collection, tune_sqlite_writes
 from backend.selectors import HTMLSelectorExtractor
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Rows per collection.add call; each add is one SQLite transaction
+BATCH_SIZE = 200
+# Texts per forward pass when encoding chunks
+EMBED_BATCH_SIZE = 64
+# Parsing moves to worker processes only when there's enough input to repay pool startup
+PARALLEL_PARSE_MIN_FILES = 2
+PARALLEL_PARSE_MIN_BYTES = 2 * 1024 * 1024
+# Chunk size / overlap, counted in embedding-model tokens
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 20
+
+# Parse-only DocumentIngestion of a pool worker process, built by _init_parse_worker
+_worker_ingestion = None
+
+
+def _init_parse_worker(tokenizer) -> None:
+    """Process-pool initializer: build this worker's own splitter and selector extractor."""
+    global _worker_ingestion
+    _worker_ingestion = DocumentIngestion.parse_only(tokenizer)
+
+
+def _parse_and_chunk(args: Tuple[str, Optional[bytes], str, str]):
+    """Process-pool worker: parse and chunk one file with this worker's parse-only instance."""
+    return _worker_ingestion._parse_file(*args)
+
 
 class DocumentIngestion:
     """Handles document parsing, chunking, embedding, and storage in ChromaDB."""
     
-    def __init__(self, persist_directory: str = "./db", reset: bool = False):
+    def __init__(self, persist_directory: str = "./db"):
         self.persist_directory = persist_directory
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_model = get_embedder()
         
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.client = get_chroma_client(persist_directory)
         
-        if reset:
-            try:
-                self.client.delete_collection("qa_knowledge_base")
-            except:
-                pass
-        
-        try:
-            self.collection = self.client.get_or_create_collection(
-                name="qa_knowledge_base",
-                metadata={"hnsw:space": "cosine"}
-            )
-        except:
-            self.collection = self.client.create_collection(
-                name="qa_knowledge_base",
-                metadata={"hnsw:space": "cosine"}
-            )
+        self._open_collection()
         
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=550,
-            chunk_overlap=120,
-            length_function=len,
+        self._init_parsing(self.embedding_model.tokenizer)
+    
+    @classmethod
+    def parse_only(cls, tokenizer) -> 'DocumentIngestion':
+        """Instance that can only parse and chunk: no embedding model or Chroma client is loaded."""
+        ingestion = cls.__new__(cls)
+        ingestion._init_parsing(tokenizer)
+        return ingestion
+    
+    def _init_parsing(self, tokenizer):
+        """Set up the state parsing and chunking need."""
+        # Sized in embedder tokens so chunks fit under the model's 256-token max_seq_length
+        # and are never truncated at encode time
+        self.text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            tokenizer,
+            chunk_size=CHUNK_TOKENS,
+            chunk_overlap=CHUNK_OVERLAP_TOKENS,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
         
         self.selector_extractor = HTMLSelectorExtractor()
         self.chunk_counter = 0
     
+    def _open_collection(self):
+        """Get or create the knowledge base collection."""
+        self.collection = open_collection(self.client)
+    
+    def _read_file(self, file_path: str) -> bytes:
+        """Read file content from disk (used when no in-memory bytes are given)."""
+        with open(file_path, 'rb') as f:
+            return f.read()
+    
+    def _hash_file(self, file_path: str) -> str:
+        """SHA-1 of a file on disk, streamed so unchanged files are never held in memory whole."""
+        with open(file_path, 'rb') as f:
+            return hashlib.file_digest(f, 'sha1').hexdigest()
+    
     def parse_document(self, file_path: str, file_content: bytes, filename: str) -> Tuple[str, str]:
         """
         Parse document based on file extension.
@@ -71,12 +115,9 @@ class DocumentIngestion:
     
     def _parse_pdf(self, file_content: bytes) -> str:
         """Extract text from PDF using PyMuPDF."""
-        import io
-        pdf_stream = io.BytesIO(file_content)
-        doc = fitz.open(stream=pdf_stream, filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
+        # PyMuPDF reads bytes directly; join pages once instead of growing a string per page
+        doc = fitz.open(stream=file_content, filetype="pdf")
+        text = "".join([page.get_text("text", sort=False) for page in doc])
         doc.close()
         return text
     
@@ -89,47 +130,61 @@ class DocumentIngestion:
     def _parse_json(self, content: str) -> str:
         """Convert JSON to readable pseudo-document."""
         try:
-            data = json.loads(content)
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError
+            data = _json_loads(content)
             return self._flatten_json(data)
         except json.JSONDecodeError:
             return content
     
     def _flatten_json(self, data: Any, prefix: str = '') -> str:
-        """Recursively flatten JSON into readable text."""
+        """Flatten JSON into readable text."""
+        # Explicit stack and one output list, so nested levels aren't joined repeatedly
         lines = []
-        if isinstance(data, dict):
-            for key, value in data.items():
-                new_prefix = f"{prefix}.{key}" if prefix else key
-                if isinstance(value, (dict, list)):
-                    lines.append(f"{new_prefix}:")
-                    lines.append(self._flatten_json(value, new_prefix))
-                else:
-                    lines.append(f"{new_prefix}: {value}")
-        elif isinstance(data, list):
-            for idx, item in enumerate(data):
-                new_prefix = f"{prefix}[{idx}]"
-                if isinstance(item, (dict, list)):
-                    lines.append(self._flatten_json(item, new_prefix))
-                else:
-                    lines.append(f"{new_prefix}: {item}")
-        else:
-            lines.append(str(data))
+        stack = [(data, prefix)]
+        while stack:
+            node, node_prefix = stack.pop()
+            if isinstance(node, (dict, list)) and not node:
+                lines.append('')
+            elif isinstance(node, dict):
+                children = []
+                for key, value in node.items():
+                    new_prefix = f"{node_prefix}.{key}" if node_prefix else key
+                    if isinstance(value, (dict, list)):
+                        children.append((f"{new_prefix}:", None))
+                        children.append((value, new_prefix))
+                    else:
+                        children.append((f"{new_prefix}: {value}", None))
+                stack.extend(reversed(children))
+            elif isinstance(node, list):
+                children = []
+                for idx, item in enumerate(node):
+                    new_prefix = f"{node_prefix}[{idx}]"
+                    if isinstance(item, (dict, list)):
+                        children.append((item, new_prefix))
+                    else:
+                        children.append((f"{new_prefix}: {item}", None))
+                stack.extend(reversed(children))
+            elif node_prefix is None:
+                lines.append(node)
+            else:
+                lines.append(str(node))
         return '\n'.join(lines)
     
     def _parse_html(self, content: str) -> str:
         """Extract both text and DOM structure from HTML."""
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        text_content = soup.get_text(separator='\n', strip=True)
+        soup = BeautifulSoup(content, 'lxml')
         
-        selectors_data = self.selector_extractor.extract_selectors(content)
+        # One walk over the parsed tree yields both the page text and the selectors
+        text_content, selectors_data = self.selector_extractor.extract_from_soup(soup)
         selector_text = self.selector_extractor.format_for_storage(selectors_data)
         
         return f"{text_content}\n\n{selector_text}"
     
-    def chunk_text(self, text: str, source_document: str, doc_type: str) -> List[Dict[str, Any]]:
+    def chunk_text(self, text: str, source_document: str, doc_type: str,
+                   file_hash: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Split text into chunks with metadata.
+        When file_hash is given, chunk IDs are derived from it so re-adding a file is idempotent.
         Returns list of chunk dictionaries.
         """
         chunks = self.text_splitter.split_text(text)
@@ -137,14 +192,21 @@ class DocumentIngestion:
         chunk_dicts = []
         for idx, chunk in enumerate(chunks):
             self.chunk_counter += 1
+            if file_hash:
+                chunk_id = f"{file_hash}:{idx}"
+            else:
+                chunk_id = f"{Path(source_document).stem}_{self.chunk_counter}"
             chunk_dict = {
-                'chunk_id': f"{Path(source_document).stem}_{self.chunk_counter}",
+                'chunk_id': chunk_id,
                 'text': chunk,
                 'source_document': source_document,
                 'doc_type': doc_type,
                 'chunk_index': idx
             }
             
+            if file_hash:
+                chunk_dict['file_hash'] = file_hash
+            
             if doc_type == 'html_dom':
                 chunk_dict['has_selectors'] = 'SELECTOR' in chunk or '#' in chunk or 'class=' in chunk
             
@@ -152,37 +214,123 @@ class DocumentIngestion:
         
         return chunk_dicts
     
-    def embed_and_store(self, chunks: List[Dict[str, Any]]) -> int:
+    def embed_and_store(self, chunks: List[Dict[str, Any]],
+                        progress_callback: Optional[Callable[[int, int], None]] = None) -> int:
         """
         Generate embeddings for chunks and store in ChromaDB.
+        All chunks are embedded in one encode call, then written in BATCH_SIZE slices.
+        progress_callback(stored, total) is called after each slice is written.
         Returns number of chunks stored.
         """
         if not chunks:
             return 0
         
+        # synchronous=NORMAL is per connection, and Chroma keeps one per thread: tune the one writing here
+        tune_sqlite_writes(self.client)
+        
         texts = [chunk['text'] for chunk in chunks]
-        embeddings = self.embedding_model.encode(texts, show_progress_bar=False)
+        embeddings = self.embedding_model.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        # fp16 output on GPU; store full-precision vectors
+        embeddings = embeddings.astype(np.float32, copy=False)
         
         ids = [chunk['chunk_id'] for chunk in chunks]
-        metadatas = [{
-            'source_document': chunk['source_document'],
-            'doc_type': chunk['doc_type'],
-            'chunk_index': chunk['chunk_index']
-        } for chunk in chunks]
-        
-        self.collection.add(
-            ids=ids,
-            embeddings=embeddings.tolist(),
-            documents=texts,
-            metadatas=metadatas
+        metadatas = []
+        for chunk in chunks:
+            metadata = {
+                'source_document': chunk['source_document'],
+                'doc_type': chunk['doc_type'],
+                'chunk_index': chunk['chunk_index']
+            }
+            if 'file_hash' in chunk:
+                metadata['file_hash'] = chunk['file_hash']
+            metadatas.append(metadata)
+        
+        total = len(chunks)
+        for start in range(0, total, BATCH_SIZE):
+            end = min(start + BATCH_SIZE, total)
+            self.collection.add(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
+            if progress_callback:
+                progress_callback(end, total)
+        
+        return total
+    
+    def _indexed_files(self) -> Dict[Optional[str], Dict[str, Any]]:
+        """Map file_hash to the chunk IDs and doc_type already stored for that file."""
+        # Chroma can't project single metadata keys, so this pulls every chunk's ID and metadata
+        # (no documents or embeddings): one pass over the collection per build, linear in its size
+        existing = self.collection.get(include=["metadatas"])
+        indexed = {}
+        for chunk_id, metadata in zip(existing['ids'], existing['metadatas']):
+            entry = indexed.setdefault(metadata.get('file_hash'), {
+                'ids': [],
+                'doc_type': metadata.get('doc_type')
+            })
+            entry['ids'].append(chunk_id)
+        return indexed
+    
+    def _parse_file(self, file_path: str, file_content: Optional[bytes], filename: str,
+                    file_hash: str) -> Tuple[Optional[str], List[Dict[str, Any]], Optional[str]]:
+        """
+        Read, parse and chunk one file.
+        Returns (doc_type, chunks, error); errors are returned rather than raised so
+        a failing file doesn't abort the other workers.
+        """
+        try:
+            if file_content is None:
+                file_content = self._read_file(file_path)
+            text_content, doc_type = self.parse_document(file_path, file_content, filename)
+            chunks = self.chunk_text(text_content, filename, doc_type, file_hash=file_hash)
+            return doc_type, chunks, None
+        except Exception as e:
+            return None, [], str(e)
+    
+    def _parse_files(self, pending: List[Tuple[str, Optional[bytes], str, str]]) -> List[Tuple]:
+        """
+        Run _parse_file over pending (file_path, file_content, filename, file_hash) tuples.
+        Large inputs are parsed in worker processes; the text work is CPU-bound and
+        independent per file. Each worker builds its own splitter from the embedder's
+        tokenizer, while embedding stays in this process with the loaded model.
+        """
+        total_bytes = sum(
+            len(content) if content is not None else os.path.getsize(path)
+            for path, content, _, _ in pending
+        )
+        use_pool = (
+            len(pending) >= PARALLEL_PARSE_MIN_FILES
+            and total_bytes >= PARALLEL_PARSE_MIN_BYTES
         )
+        if not use_pool:
+            return [self._parse_file(*args) for args in pending]
         
-        return len(chunks)
+        with ProcessPoolExecutor(
+            max_workers=min(os.cpu_count() or 1, len(pending)),
+            initializer=_init_parse_worker,
+            initargs=(self.embedding_model.tokenizer,)
+        ) as executor:
+            return list(executor.map(_parse_and_chunk, pending))
     
-    def ingest_documents(self, uploaded_files: List[Tuple[str, bytes, str]]) -> Dict[str, Any]:
+    def ingest_documents(self, uploaded_files: List[Tuple[str, Optional[bytes], str]],
+                         progress_callback: Optional[Callable[[int, int], None]] = None,
+                         prune: bool = False) -> Dict[str, Any]:
         """
         Main ingestion pipeline.
         uploaded_files: List of (file_path, file_content, filename) tuples.
+        If file_content is None, the file is read from file_path.
+        Files whose content hash is already in the collection are not re-embedded.
+        With prune=True, chunks from files not in uploaded_files are removed.
+        Files are parsed and chunked first, then all new chunks are embedded and stored together.
+        progress_callback is passed through to embed_and_store.
         Returns summary statistics.
         """
         stats = {
@@ -192,29 +340,77 @@ class DocumentIngestion:
             'doc_types': {}
         }
         
+        indexed = self._indexed_files()
+        seen_hashes = set()
+        reused_chunks = 0
+        # One stats entry per file, in upload order; new files are filled in after parsing
+        entries = []
+        pending = []
         for file_path, file_content, filename in uploaded_files:
             try:
-                text_content, doc_type = self.parse_document(file_path, file_content, filename)
-                
-                chunks = self.chunk_text(text_content, filename, doc_type)
-                
-                num_stored = self.embed_and_store(chunks)
-                
-                stats['total_files'] += 1
-                stats['total_chunks'] += num_stored
-                stats['files_processed'].append({
-                    'filename': filename,
-                    'doc_type': doc_type,
-                    'chunks': num_stored
-                })
-                
-                stats['doc_types'][doc_type] = stats['doc_types'].get(doc_type, 0) + 1
-                
+                # Path-only files are streamed through the hash; only new ones are read in full, by the parser
+                if file_content is not None:
+                    file_hash = hashlib.sha1(file_content).hexdigest()
+                else:
+                    file_hash = self._hash_file(file_path)
             except Exception as e:
-                stats['files_processed'].append({
+                entries.append({'filename': filename, 'error': str(e)})
+                continue
+            
+            if file_hash in seen_hashes:
+                entries.append({'filename': filename, 'status': 'duplicate', 'chunks': 0})
+                continue
+            seen_hashes.add(file_hash)
+            
+            if file_hash in indexed:
+                # Unchanged since the last build; reuse the stored chunks
+                num_chunks = len(indexed[file_hash]['ids'])
+                reused_chunks += num_chunks
+                entries.append({
                     'filename': filename,
-                    'error': str(e)
+                    'doc_type': indexed[file_hash]['doc_type'],
+                    'status': 'unchanged',
+                    'chunks': num_chunks
                 })
+            else:
+                entries.append(len(pending))  # Position in pending, resolved after parsing
+                pending.append((file_path, file_content, filename, file_hash))
+        
+        parsed = self._parse_files(pending)
+        
+        all_chunks = []
+        for file_index, entry in enumerate(entries):
+            if isinstance(entry, int):
+                filename = pending[entry][2]
+                doc_type, chunks, error = parsed[entry]
+                if error is not None:
+                    entry = {'filename': filename, 'error': error}
+                else:
+                    for chunk in chunks:
+                        chunk['file_index'] = file_index
+                    all_chunks.extend(chunks)
+                    entry = {
+                        'filename': filename,
+                        'doc_type': doc_type,
+                        'status': 'ingested',
+                        'chunks': len(chunks)
+                    }
+            
+            stats['files_processed'].append(entry)
+            if 'doc_type' in entry:
+                stats['total_files'] += 1
+                stats['doc_types'][entry['doc_type']] = stats['doc_types'].get(entry['doc_type'], 0) + 1
+        
+        if prune:
+            stale_ids = [
+                chunk_id
+                for file_hash, entry in indexed.items() if file_hash not in seen_hashes
+                for chunk_id in entry['ids']
+            ]
+            if stale_ids:
+                self.collection.delete(ids=stale_ids)
+        
+        stats['total_chunks'] = reused_chunks + self.embed_and_store(all_chunks, progress_callback)
         
         return stats
     
@@ -1,41 +1,125 @@
-import os
 import json
-from typing import List, Dict, Any
-from sentence_transformers import SentenceTransformer
-import chromadb
+import functools
+from typing import List, Dict, Any, Optional
+import numpy as np
 import google.generativeai as genai
 
+from backend._shared import get_embedder, get_chroma_client, get_gemini, open_collection
+
+# Number of distinct query texts whose embeddings RAGEngine keeps in memory
+QUERY_CACHE_SIZE = 512
+# Document types used as test case context; html_dom selectors are retrieved separately for scripts
+TEST_CASE_DOC_TYPES = ['spec', 'ui_ux', 'api']
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+class _StreamingArrayParser:
+    """
+    Incrementally parses the elements of a top-level JSON array as text is fed in.
+    Text before the opening '[' (e.g. a markdown fence) is skipped; if the top level
+    turns out to be an object, or an element fails to parse, `failed` is set and the
+    caller should fall back to parsing the full response.
+    """
+    
+    def __init__(self):
+        self.failed = False
+        self.closed = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._pieces = []
+    
+    def feed(self, text: str) -> List[Any]:
+        """Consume the next piece of text and return the array elements it completed."""
+        completed = []
+        if self.failed or self.closed:
+            return completed
+        start = 0 if self._pieces else None
+        for i, ch in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if not self._started:
+                if ch == '[':
+                    self._started = True
+                    self._depth = 1
+                elif ch == '{':
+                    self.failed = True
+                    return completed
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == '{' or ch == '[':
+                if self._depth == 1:
+                    start = i
+                self._depth += 1
+            elif ch == '}' or ch == ']':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.closed = True
+                    return completed
+                if self._depth == 1 and start is not None:
+                    self._pieces.append(text[start:i + 1])
+                    element = ''.join(self._pieces)
+                    self._pieces = []
+                    start = None
+                    try:
+                        completed.append(_json_loads(element))
+                    except json.JSONDecodeError:
+                        self.failed = True
+                        return completed
+        if start is not None:
+            self._pieces.append(text[start:])
+        return completed
+
 
 class RAGEngine:
     """RAG (Retrieval-Augmented Generation) engine for test case generation."""
     
     def __init__(self, persist_directory: str = "./db"):
         self.persist_directory = persist_directory
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_model = get_embedder()
         
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.client = get_chroma_client(persist_directory)
         
-        try:
-            self.collection = self.client.get_collection("qa_knowledge_base")
-        except:
-            self.collection = self.client.create_collection(
-                name="qa_knowledge_base",
-                metadata={"hnsw:space": "cosine"}
-            )
+        self.collection = open_collection(self.client)
         
-        gemini_api_key = os.environ.get("GEMINI_API_KEY")
-        genai.configure(api_key=gemini_api_key)
+        get_gemini()
+        
+        # Repeated queries skip the encoder; embeddings don't depend on the indexed documents
+        self._embed_query = functools.lru_cache(maxsize=QUERY_CACHE_SIZE)(self._encode_query)
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Encode a single query into a read-only (1, dim) float32 array."""
+        query_embedding = self.embedding_model.encode([query], show_progress_bar=False).astype(np.float32, copy=False)
+        query_embedding.flags.writeable = False
+        return query_embedding
     
-    def retrieve_context(self, query: str, top_k: int = 6) -> List[Dict[str, Any]]:
+    def retrieve_context(self, query: str, top_k: int = 6,
+                         doc_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
         Retrieve top-K relevant chunks for a query.
+        doc_types, if given, restricts the search to chunks of those document types.
         Returns list of retrieved chunks with metadata.
         """
-        query_embedding = self.embedding_model.encode([query], show_progress_bar=False)[0]
+        query_embeddings = self._embed_query(query)
         
+        where = {"doc_type": {"$in": list(doc_types)}} if doc_types else None
         results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=top_k
+            query_embeddings=query_embeddings,
+            n_results=top_k,
+            where=where
         )
         
         retrieved_chunks = []
@@ -118,8 +202,27 @@ Generate test cases as a JSON array. Remember:
             response = model.generate_content([
                 system_prompt,
                 user_prompt
-            ])
-            content = response.text
+            ], stream=True)
+            
+            # Parse and validate test cases as they stream in, overlapping the work with the download
+            parser = _StreamingArrayParser()
+            parts = []
+            validated_cases = []
+            for chunk in response:
+                # .text raises ValueError on chunks without parts (e.g. a trailing finish-reason chunk)
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                parts.append(text)
+                for tc in parser.feed(text):
+                    if self._validate_test_case(tc):
+                        validated_cases.append(tc)
+            if parser.closed and not parser.failed:
+                return validated_cases
+            
+            # Not a plain JSON array; parse the full response instead
+            content = ''.join(parts)
             
             # Clean up markdown code blocks if present
             if content.startswith("```json"):
@@ -128,7 +231,8 @@ Generate test cases as a JSON array. Remember:
                 content = content.replace("```", "").strip()
             
             try:
-                parsed = json.loads(content)
+                # orjson.JSONDecodeError subclasses json.JSONDecodeError
+                parsed = _json_loads(content)
                 if isinstance(parsed, dict) and 'test_cases' in parsed:
                     test_cases = parsed['test_cases']
                 elif isinstance(parsed, dict) and 'testCases' in parsed:
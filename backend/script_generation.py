@@ -1,9 +1,91 @@
-import os
+import re
 import json
-from typing import Dict, Any, List
+import time
+import asyncio
+import threading
+from typing import Dict, Any, List, Tuple, Callable
 import google.generativeai as genai
-from sentence_transformers import SentenceTransformer
-import chromadb
+from google.api_core.exceptions import ResourceExhausted
+import numpy as np
+
+from backend._shared import get_embedder, get_chroma_client, get_gemini, open_collection
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Seconds to wait before retrying a quota rejection when the server gives no retry delay (one quota window)
+RATE_LIMIT_BACKOFF = 60
+# Default number of Gemini requests generate_scripts_batch keeps in flight
+BATCH_CONCURRENCY = 8
+# Fixed query used to pull HTML selector chunks from the knowledge base
+SELECTOR_QUERY = "HTML selectors buttons inputs forms cart payment shipping discount"
+
+_RETRY_IN_RE = re.compile(r"retry in ([\d.]+)s", re.IGNORECASE)
+
+
+def _retry_delay(error: ResourceExhausted) -> float:
+    """Seconds the server asked us to wait (RetryInfo detail or "retry in Ns"), else RATE_LIMIT_BACKOFF."""
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is None:
+            continue
+        if hasattr(delay, "total_seconds"):
+            return delay.total_seconds()
+        return delay.seconds + delay.nanos / 1e9
+    match = _RETRY_IN_RE.search(str(error))
+    if match:
+        return float(match.group(1))
+    return RATE_LIMIT_BACKOFF
+
+
+class _TokenBucket:
+    """
+    Allows `rpm` requests per minute. The bucket holds at most `burst` tokens and starts full,
+    so no 60s window sees more than rpm + burst - 1 requests: with the default burst of 1,
+    requests are spaced 60/rpm seconds apart. Safe to share across event loops.
+    """
+    
+    def __init__(self, rpm: int, burst: int = 1):
+        self.rpm = rpm
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    async def acquire(self):
+        """Wait until a request may be sent, then take its token."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rpm / 60)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * 60 / self.rpm
+            await asyncio.sleep(wait)
+    
+    def drain(self):
+        """Empty the bucket after a quota rejection so queued requests wait for refills too."""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+
+# One limiter per rpm for the whole process: the quota is per API key, not per generator
+# (engines are rebuilt after every KB build)
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(rpm: int) -> _TokenBucket:
+    """Process-wide token bucket for `rpm` requests per minute."""
+    with _rate_limiters_lock:
+        if rpm not in _rate_limiters:
+            _rate_limiters[rpm] = _TokenBucket(rpm)
+        return _rate_limiters[rpm]
 
 
 class SeleniumScriptGenerator:
@@ -11,28 +93,35 @@ class SeleniumScriptGenerator:
     
     def __init__(self, persist_directory: str = "./db"):
         self.persist_directory = persist_directory
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_model = get_embedder()
         
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.client = get_chroma_client(persist_directory)
         
-        try:
-            self.collection = self.client.get_collection("qa_knowledge_base")
-        except:
-            self.collection = None
+        self.collection = open_collection(self.client)
+        
+        # The selector query is fixed: embed it once here (during app warm-up) and retrieve its results once per generator
+        self._selector_query_embedding = self.embedding_model.encode(
+            [SELECTOR_QUERY], show_progress_bar=False
+        ).astype(np.float32, copy=False)
+        self._selector_context = None
+        self._selector_lock = threading.Lock()
         
-        gemini_api_key = os.environ.get("GEMINI_API_KEY")
-        genai.configure(api_key=gemini_api_key)
+        get_gemini()
     
     def retrieve_html_selectors(self) -> str:
-        """Retrieve HTML selector information from the knowledge base."""
-        if not self.collection:
+        """Retrieve HTML selector information from the knowledge base (cached after the first call)."""
+        if self.collection.count() == 0:
             return ""
         
-        query = "HTML selectors buttons inputs forms cart payment shipping discount"
-        query_embedding = self.embedding_model.encode([query], show_progress_bar=False)[0]
-        
+        with self._selector_lock:
+            if self._selector_context is None:
+                self._selector_context = self._query_html_selectors()
+        return self._selector_context
+    
+    def _query_html_selectors(self) -> str:
+        """Query the knowledge base for HTML selector chunks."""
         results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
+            query_embeddings=self._selector_query_embedding,
             n_results=5,
             where={"doc_type": "html_dom"}
         )
@@ -46,33 +135,41 @@ class SeleniumScriptGenerator:
     
     def retrieve_relevant_docs(self, test_case: Dict[str, Any]) -> str:
         """Retrieve relevant documentation based on test case content."""
-        if not self.collection:
+        if self.collection.count() == 0:
             return ""
-        query = f"{test_case.get('Feature', '')} {test_case.get('Test_Scenario', '')}"
-        query_embedding = self.embedding_model.encode([query], show_progress_bar=False)[0]
+        return self.retrieve_relevant_docs_batch([test_case])[0]
+    
+    def retrieve_relevant_docs_batch(self, test_cases: List[Dict[str, Any]]) -> List[str]:
+        """Retrieve documentation for several test cases with one encode and one Chroma query."""
+        if not test_cases or self.collection.count() == 0:
+            return ["" for _ in test_cases]
+        queries = [f"{tc.get('Feature', '')} {tc.get('Test_Scenario', '')}" for tc in test_cases]
+        query_embeddings = self.embedding_model.encode(
+            queries, batch_size=32, show_progress_bar=False
+        ).astype(np.float32, copy=False)
         results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
+            query_embeddings=query_embeddings,
             n_results=3
         )
-        doc_context = ""
-        if results['documents'] and len(results['documents']) > 0:
-            for idx, doc in enumerate(results['documents'][0]):
-                source = results['metadatas'][0][idx].get('source_document', 'unknown')
+        doc_contexts = []
+        for documents, metadatas in zip(results['documents'] or [], results['metadatas'] or []):
+            doc_context = ""
+            for doc, metadata in zip(documents, metadatas):
+                source = metadata.get('source_document', 'unknown')
                 doc_context += f"[{source}]\n{doc}\n\n"
-        return doc_context
+            doc_contexts.append(doc_context)
+        doc_contexts.extend("" for _ in range(len(test_cases) - len(doc_contexts)))
+        return doc_contexts
 
-    def generate_script(self, test_case: Dict[str, Any], html_content: str = None) -> str:
-        """
-        Generate a production-ready Selenium Python script.
-        Args:
-            test_case: The test case dictionary
-            html_content: Optional HTML content for additional selector extraction
-        Returns:
-            Python script as a string
-        """
+    def _build_prompts(self, test_case: Dict[str, Any], doc_context: str = None) -> Tuple[str, str]:
+        """Retrieve selector and doc context and build the (system, user) prompts."""
         selector_context = self.retrieve_html_selectors()
-        doc_context = self.retrieve_relevant_docs(test_case)
-        test_case_str = json.dumps(test_case, indent=2)
+        if doc_context is None:
+            doc_context = self.retrieve_relevant_docs(test_case)
+        if orjson is not None:
+            test_case_str = orjson.dumps(test_case, option=orjson.OPT_INDENT_2).decode('utf-8')
+        else:
+            test_case_str = json.dumps(test_case, indent=2)
         system_prompt = """You are an expert Selenium automation engineer specializing in writing clean, production-ready test scripts.
 
 CRITICAL REQUIREMENTS:
@@ -115,27 +212,26 @@ Requirements:
 - Make the script production-ready and executable
 
 Generate the complete Python script now."""
-        try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content([
-                system_prompt,
-                user_prompt
-            ])
-            script = response.text
-            if script.startswith("```python"):
-                script = script.replace("```python", "").replace("```", "").strip()
-            elif script.startswith("```"):
-                script = script.replace("```", "").strip()
-            header = f"""#!/usr/bin/env python3
+        return system_prompt, user_prompt
+
+    def _format_script(self, test_case: Dict[str, Any], script: str) -> str:
+        """Strip markdown fences from the LLM output and prepend the script header."""
+        if script.startswith("```python"):
+            script = script.replace("```python", "").replace("```", "").strip()
+        elif script.startswith("```"):
+            script = script.replace("```", "").strip()
+        header = f"""#!/usr/bin/env python3
 # Auto-generated Selenium test script
 # Test ID: {test_case.get('Test_ID', 'Unknown')}
 # Feature: {test_case.get('Feature', 'Unknown')}
 # Grounded in: {', '.join(test_case.get('Grounded_In', []))}
 
 """
-            return header + script
-        except Exception as e:
-            error_script = f"""#!/usr/bin/env python3
+        return header + script
+
+    def _error_script(self, test_case: Dict[str, Any], e: Exception) -> str:
+        """Build a placeholder script describing a generation failure."""
+        error_script = f"""#!/usr/bin/env python3
 # ERROR: Failed to generate script
 # Error: {str(e)}
 
@@ -162,4 +258,90 @@ def run_test():
 if __name__ == "__main__":
     run_test()
 """
-            return error_script
+        return error_script
+
+    def generate_script(self, test_case: Dict[str, Any], html_content: str = None) -> str:
+        """
+        Generate a production-ready Selenium Python script.
+        Args:
+            test_case: The test case dictionary
+            html_content: Optional HTML content for additional selector extraction
+        Returns:
+            Python script as a string
+        """
+        system_prompt, user_prompt = self._build_prompts(test_case)
+        try:
+            model = genai.GenerativeModel('gemini-2.5-flash')
+            response = model.generate_content([
+                system_prompt,
+                user_prompt
+            ])
+            return self._format_script(test_case, response.text)
+        except Exception as e:
+            return self._error_script(test_case, e)
+
+    async def generate_script_async(self, test_case: Dict[str, Any], max_retries: int = 3,
+                                    doc_context: str = None, rate_limiter: _TokenBucket = None) -> str:
+        """
+        Async variant of generate_script using Gemini's async client.
+        Retrieval runs in a worker thread; quota errors are retried after the server's retry delay.
+        Pass doc_context (from retrieve_relevant_docs_batch) to skip the per-case doc retrieval,
+        and rate_limiter to take a token before every request (including retries).
+        """
+        system_prompt, user_prompt = await asyncio.to_thread(self._build_prompts, test_case, doc_context)
+        model = genai.GenerativeModel('gemini-2.5-flash')
+        for attempt in range(max_retries + 1):
+            if rate_limiter:
+                await rate_limiter.acquire()
+            try:
+                response = await model.generate_content_async([
+                    system_prompt,
+                    user_prompt
+                ])
+                return self._format_script(test_case, response.text)
+            except ResourceExhausted as e:
+                if attempt == max_retries:
+                    return self._error_script(test_case, e)
+                if rate_limiter:
+                    rate_limiter.drain()
+                await asyncio.sleep(_retry_delay(e))
+            except Exception as e:
+                return self._error_script(test_case, e)
+
+    async def generate_scripts_batch(self, test_cases: List[Dict[str, Any]], concurrency: int = BATCH_CONCURRENCY,
+                                     on_complete: Callable[[int, str], None] = None,
+                                     rpm: int = None) -> List[Tuple[str, str, Exception]]:
+        """
+        Generate scripts for several test cases with up to `concurrency` Gemini requests in flight
+        and, when rpm is given, no more than `rpm` requests started per minute.
+        on_complete(completed, tc_id) is called as each script finishes.
+        Returns a list of (tc_id, script, error) in the order of test_cases.
+        """
+        sem = asyncio.Semaphore(concurrency)
+        rate_limiter = get_rate_limiter(rpm) if rpm else None
+        # One batched encode + Chroma query for every case's doc context;
+        # on failure each case falls back to retrieving (and reporting) its own
+        try:
+            doc_contexts = await asyncio.to_thread(self.retrieve_relevant_docs_batch, test_cases)
+        except Exception:
+            doc_contexts = [None] * len(test_cases)
+        
+        async def _one(idx, tc):
+            tc_id = tc.get('Test_ID', f'test_{idx}')
+            async with sem:
+                try:
+                    script = await self.generate_script_async(
+                        tc, doc_context=doc_contexts[idx], rate_limiter=rate_limiter
+                    )
+                    return idx, tc_id, script, None
+                except Exception as e:
+                    return idx, tc_id, None, e
+        
+        tasks = [asyncio.create_task(_one(idx, tc)) for idx, tc in enumerate(test_cases)]
+        results = [None] * len(tasks)
+        for completed, next_done in enumerate(asyncio.as_completed(tasks), 1):
+            idx, tc_id, script, error = await next_done
+            results[idx] = (tc_id, script, error)
+            if on_complete:
+                on_complete(completed, tc_id)
+        return results
@@ -1,6 +1,17 @@
 import re
-from typing import List, Dict, Any
-from bs4 import BeautifulSoup
+from typing import List, Dict, Any, Optional, Tuple
+from bs4 import BeautifulSoup, Tag
+
+# Keyword alternations matched against lowercased element text / attributes in _categorize_semantic
+CART_TEXT_RE = re.compile(r'cart|quantity')
+CART_ATTR_RE = re.compile(r'cart|qty|quantity|total')
+PAYMENT_TEXT_RE = re.compile(r'payment|pay|credit|paypal')
+PAYMENT_ATTR_RE = re.compile(r'payment|pay')
+SHIPPING_TEXT_RE = re.compile(r'shipping|standard|express|delivery')
+SHIPPING_ATTR_RE = re.compile(r'shipping|delivery')
+DISCOUNT_TEXT_RE = re.compile(r'discount|coupon|promo')
+DISCOUNT_ATTR_RE = re.compile(r'discount|coupon|promo|code')
+VALIDATION_CLASS_RE = re.compile(r'error|invalid|validation')
 
 
 class HTMLSelectorExtractor:
@@ -15,16 +26,32 @@ class HTMLSelectorExtractor:
         Extract all selectors (id, name, class, data-test) from HTML.
         Returns a dictionary with selectors organized by type and semantic meaning.
         """
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
+        return self.extract_selectors_from_soup(BeautifulSoup(html_content, 'lxml'))
+    
+    def extract_selectors_from_soup(self, soup: BeautifulSoup) -> Dict[str, Any]:
+        """Same as extract_selectors, for HTML that has already been parsed."""
+        return self._walk(soup)
+    
+    def extract_from_soup(self, soup: BeautifulSoup) -> Tuple[str, Dict[str, Any]]:
+        """
+        Extract text and selectors from parsed HTML in a single traversal.
+        The text matches soup.get_text(separator='\n', strip=True).
+        """
+        text_parts = []
+        selectors_data = self._walk(soup, text_parts)
+        return '\n'.join(text_parts), selectors_data
+    
+    def _walk(self, soup: BeautifulSoup, text_parts: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Collect selectors from every element; also gather stripped text into text_parts if given."""
+        # Sets so each selector is hashed once as it's seen, instead of deduplicated at the end
+        all_selectors = set()
+        by_type = {
+            'ids': set(),
+            'names': set(),
+            'classes': set(),
+            'data_test': set()
+        }
         selectors_data = {
-            'all_selectors': [],
-            'by_type': {
-                'ids': [],
-                'names': [],
-                'classes': [],
-                'data_test': []
-            },
             'semantic': {
                 'buttons': [],
                 'inputs': [],
@@ -37,9 +64,19 @@ class HTMLSelectorExtractor:
             }
         }
         
-        all_elements = soup.find_all()
-        
-        for element in all_elements:
+        # Same string types get_text() keeps (skips comments, script and style contents)
+        string_types = soup.interesting_string_types
+        if isinstance(string_types, type):
+            string_types = (string_types,)
+        
+        for element in soup.descendants:
+            if not isinstance(element, Tag):
+                if text_parts is not None and type(element) in string_types:
+                    text = element.strip()
+                    if text:
+                        text_parts.append(text)
+                continue
+            
             element_info = {
                 'tag': element.name,
                 'selectors': []
@@ -47,15 +84,15 @@ class HTMLSelectorExtractor:
             
             if element.get('id'):
                 selector = f"#{element['id']}"
-                selectors_data['by_type']['ids'].append(selector)
-                selectors_data['all_selectors'].append(selector)
+                by_type['ids'].add(selector)
+                all_selectors.add(selector)
                 element_info['selectors'].append(selector)
                 element_info['id'] = element['id']
             
             if element.get('name'):
                 selector = f"[name='{element['name']}']"
-                selectors_data['by_type']['names'].append(selector)
-                selectors_data['all_selectors'].append(selector)
+                by_type['names'].add(selector)
+                all_selectors.add(selector)
                 element_info['selectors'].append(selector)
                 element_info['name'] = element['name']
             
@@ -63,19 +100,20 @@ class HTMLSelectorExtractor:
                 classes = element['class'] if isinstance(element['class'], list) else [element['class']]
                 for cls in classes:
                     selector = f".{cls}"
-                    selectors_data['by_type']['classes'].append(selector)
-                    selectors_data['all_selectors'].append(selector)
+                    by_type['classes'].add(selector)
+                    all_selectors.add(selector)
                     element_info['selectors'].append(selector)
             
             if element.get('data-test'):
                 selector = f"[data-test='{element['data-test']}']"
-                selectors_data['by_type']['data_test'].append(selector)
-                selectors_data['all_selectors'].append(selector)
+                by_type['data_test'].add(selector)
+                all_selectors.add(selector)
                 element_info['selectors'].append(selector)
             
             self._categorize_semantic(element, element_info, selectors_data)
         
-        selectors_data['all_selectors'] = list(set(selectors_data['all_selectors']))
+        selectors_data['all_selectors'] = list(all_selectors)
+        selectors_data['by_type'] = {kind: list(found) for kind, found in by_type.items()}
         
         return selectors_data
     
@@ -95,31 +133,21 @@ class HTMLSelectorExtractor:
         if element.name == 'form':
             selectors_data['semantic']['forms'].append(element_info)
         
-        if any(keyword in text_content for keyword in ['cart', 'add to cart', 'quantity']):
-            selectors_data['semantic']['cart_elements'].append(element_info)
+        attributes = f"{element_id} {element_name} {element_class}"
         
-        if any(keyword in element_id + element_name + element_class for keyword in ['cart', 'qty', 'quantity', 'total']):
+        if CART_TEXT_RE.search(text_content) or CART_ATTR_RE.search(attributes):
             selectors_data['semantic']['cart_elements'].append(element_info)
         
-        if any(keyword in text_content for keyword in ['payment', 'pay', 'credit', 'paypal']):
-            selectors_data['semantic']['payment_elements'].append(element_info)
-        
-        if any(keyword in element_id + element_name + element_class for keyword in ['payment', 'pay']):
+        if PAYMENT_TEXT_RE.search(text_content) or PAYMENT_ATTR_RE.search(attributes):
             selectors_data['semantic']['payment_elements'].append(element_info)
         
-        if any(keyword in text_content for keyword in ['shipping', 'standard', 'express', 'delivery']):
+        if SHIPPING_TEXT_RE.search(text_content) or SHIPPING_ATTR_RE.search(attributes):
             selectors_data['semantic']['shipping_elements'].append(element_info)
         
-        if any(keyword in element_id + element_name + element_class for keyword in ['shipping', 'delivery']):
-            selectors_data['semantic']['shipping_elements'].append(element_info)
-        
-        if any(keyword in text_content for keyword in ['discount', 'coupon', 'promo']):
-            selectors_data['semantic']['discount_elements'].append(element_info)
-        
-        if any(keyword in element_id + element_name + element_class for keyword in ['discount', 'coupon', 'promo', 'code']):
+        if DISCOUNT_TEXT_RE.search(text_content) or DISCOUNT_ATTR_RE.search(attributes):
             selectors_data['semantic']['discount_elements'].append(element_info)
         
-        if any(keyword in element_class for keyword in ['error', 'invalid', 'validation']):
+        if VALIDATION_CLASS_RE.search(element_class):
             selectors_data['semantic']['validation_elements'].append(element_info)
     
     def format_for_storage(self, selectors_data: Dict) -> str:
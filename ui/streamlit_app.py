@@ -9,8 +9,8 @@ Responsibilities:
 2. Add backend and repo root to sys.path for imports to work
 3. Load Streamlit Cloud secrets into os.environ (for GEMINI_API_KEY, etc.)
 4. Fall back to local .env loading if available and python-dotenv is installed
-5. Execute app.py with proper __main__ semantics using runpy.run_path()
-6. Provide diagnostics if import/execution fails
+5. Execute app.py as a __main__ module from a cached, precompiled code object
+6. Provide diagnostics if import/execution fails (verbose startup logging with QUANTUMQA_WRAPPER_DEBUG=1)
 
 This approach ensures:
 - Relative paths in app.py (assets/, db/, backend/, etc.) work correctly
@@ -20,121 +20,323 @@ This approach ensures:
 
 import os
 import sys
-import runpy
+import hashlib
+import marshal
+import compileall
+import itertools
+import importlib.abc
+import importlib.util
+import tomllib
+import threading
 import traceback
-from pathlib import Path
 
+# Paths are resolved once, as plain strings: this wrapper is at ui/streamlit_app.py
+# and the repo root is the parent of the ui/ directory
+_HERE = os.path.dirname(os.path.abspath(__file__))  # ui/
+_REPO_ROOT = os.path.dirname(_HERE)                 # QuantumQA/
+_BACKEND_DIR = os.path.join(_REPO_ROOT, "backend")
+_ENV_FILE = os.path.join(_REPO_ROOT, ".env")
+_APP_FILE = os.path.join(_REPO_ROOT, "app.py")
+# Same locations st.secrets reads; the project file overrides the global one
+_SECRETS_FILES = (
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+    os.path.join(_REPO_ROOT, ".streamlit", "secrets.toml"),
+)
 
-def setup_environment_and_run():
+# Fixed for the life of the process, so probed once at import
+_ON_STREAMLIT_CLOUD = bool(os.environ.get("STREAMLIT_SHARING_MODE")) or os.path.isdir("/mount/src")
+
+# Marshalled code objects for app.py, so unchanged sources skip parsing and compiling
+CODE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "quantumqa")
+
+# Environment variable names, as constants (identifier-like literals are already interned)
+DEBUG_ENV_VAR = "QUANTUMQA_WRAPPER_DEBUG"
+GEMINI_KEY_ENV_VAR = "GEMINI_API_KEY"
+
+# [INFO]/[DEBUG] output only when QUANTUMQA_WRAPPER_DEBUG is set; errors and warnings always print
+WRAPPER_DEBUG = bool(os.environ.get(DEBUG_ENV_VAR))
+log = print if WRAPPER_DEBUG else (lambda *args, **kwargs: None)
+
+
+def load_app_code(app_file: str):
+    """
+    Return the compiled code object for app.py.
+    The cache file is keyed by app.py's path, interpreter, mtime and size; a stale or
+    unreadable cache is ignored and the source is compiled (and cached) again.
+    """
+    stat = os.stat(app_file)
+    # Several checkouts share CODE_CACHE_DIR: the path hash keeps their caches (and cleanup) apart
+    path_hash = hashlib.sha1(os.path.abspath(app_file).encode()).hexdigest()[:16]
+    cache_prefix = f"app.{path_hash}."
+    cache_name = f"{cache_prefix}{sys.implementation.cache_tag}.{stat.st_mtime_ns}.{stat.st_size}.pyc"
+    cache_file = os.path.join(CODE_CACHE_DIR, cache_name)
+    try:
+        with open(cache_file, "rb") as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    
+    with open(app_file, "rb") as f:
+        code = compile(f.read(), app_file, "exec")
+    try:
+        os.makedirs(CODE_CACHE_DIR, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            marshal.dump(code, f)
+        os.replace(tmp_file, cache_file)
+        for name in os.listdir(CODE_CACHE_DIR):
+            if name != cache_name and name.startswith(cache_prefix) and name.endswith(".pyc"):
+                os.unlink(os.path.join(CODE_CACHE_DIR, name))
+    except OSError as e:
+        log(f"[DEBUG] Could not write code cache {cache_file}: {e}")
+    return code
+
+
+class _BackendFinder(importlib.abc.MetaPathFinder):
+    """
+    Resolves `backend` and its modules from one listing of backend/, so backend
+    imports don't walk and stat every sys.path entry.
+    """
+    
+    def __init__(self, backend_dir: str):
+        self.backend_dir = backend_dir
+        self.modules = {}
+        for entry in os.scandir(backend_dir):
+            if entry.name == "__init__.py":
+                self.modules["backend"] = entry.path
+            elif entry.name.endswith(".py") and entry.is_file():
+                self.modules["backend." + entry.name[:-3]] = entry.path
+    
+    def find_spec(self, fullname, path=None, target=None):
+        location = self.modules.get(fullname)
+        if location is None:
+            return None
+        if fullname == "backend":
+            return importlib.util.spec_from_file_location(
+                fullname, location, submodule_search_locations=[self.backend_dir]
+            )
+        return importlib.util.spec_from_file_location(fullname, location)
+
+
+def install_backend_finder():
+    """Put a _BackendFinder first on sys.meta_path (once per process, across reruns)."""
+    for finder in sys.meta_path:
+        if getattr(finder, "backend_dir", None) == _BACKEND_DIR:
+            return
+    try:
+        sys.meta_path.insert(0, _BackendFinder(_BACKEND_DIR))
+    except OSError as e:
+        log(f"[DEBUG] backend import finder not installed: {e}")
+
+
+def warm_backend_bytecode() -> None:
+    """
+    Byte-compile backend/ on a daemon thread, so the first backend imports find
+    fresh .pyc files (e.g. on a new container with no __pycache__). Skipped once
+    backend has been imported, as on Streamlit reruns.
+    """
+    if "backend" in sys.modules:
+        return
+    # compile_dir only rewrites .pyc files that are missing or out of date
+    threading.Thread(
+        target=compileall.compile_dir, args=(_BACKEND_DIR,),
+        kwargs={"maxlevels": 0, "quiet": 2}, name="backend-bytecode-warm", daemon=True
+    ).start()
+
+
+def export_to_environ(values: dict) -> None:
+    """
+    Copy values into os.environ as strings, overriding existing variables, but
+    only writing (and so calling putenv) for keys whose value actually changes,
+    which on Streamlit reruns is usually none of them.
+    """
+    environ = os.environ
+    for key, value in values.items():
+        str_value = value if isinstance(value, str) else str(value)
+        if environ.get(key) != str_value:
+            environ[key] = str_value
+
+
+def load_streamlit_secrets() -> bool:
+    """Load Streamlit secrets into os.environ; returns True if any were found."""
+    # Under Streamlit (or on Streamlit Cloud) st.secrets is used, since streamlit is
+    # imported anyway; a plain `python` run reads secrets.toml with tomllib instead
+    # of importing streamlit just for this
+    if _ON_STREAMLIT_CLOUD or "streamlit" in sys.modules:
+        # Locally st.secrets raises when no secrets.toml exists; look first instead of
+        # raising and catching that on every run
+        if not _ON_STREAMLIT_CLOUD and not any(os.path.exists(path) for path in _SECRETS_FILES):
+            log("[DEBUG] No Streamlit secrets found (expected locally)")
+            return False
+        try:
+            import streamlit as st
+            # One snapshot, so secrets.toml is parsed and walked once
+            secrets = dict(st.secrets) if hasattr(st, 'secrets') else {}
+            if secrets:
+                log("[INFO] Streamlit secrets detected. Loading into os.environ...")
+                export_to_environ(secrets)
+                log(f"[INFO] Loaded {len(secrets)} secret(s) from Streamlit")
+                return True
+        except Exception as e:
+            log(f"[DEBUG] Streamlit secrets not available (expected locally): {e}")
+    else:
+        secrets = {}
+        for secrets_file in _SECRETS_FILES:
+            if os.path.exists(secrets_file):
+                try:
+                    with open(secrets_file, "rb") as f:
+                        secrets.update(tomllib.load(f))
+                except (OSError, tomllib.TOMLDecodeError) as e:
+                    print(f"[WARNING] Failed to read {secrets_file}: {e}")
+        if secrets:
+            export_to_environ(secrets)
+            log(f"[INFO] Loaded {len(secrets)} secret(s) from secrets.toml")
+            return True
+        log("[DEBUG] No Streamlit secrets found (expected locally)")
+    return False
+
+
+def _setup():
     """
     Set up paths, environment, and execute app.py with __main__ semantics.
     """
     
     # ========== STEP 1: DETERMINE REPO ROOT ==========
-    # This wrapper is at: ui/streamlit_app.py
-    # Repo root is the parent of the ui/ directory
-    WRAPPER_DIR = Path(__file__).parent  # ui/
-    REPO_ROOT = WRAPPER_DIR.parent       # QuantumQA/
-    
-    print(f"[INFO] Repo root: {REPO_ROOT}")
-    print(f"[INFO] Wrapper dir: {WRAPPER_DIR}")
+    # Resolved at import time (_REPO_ROOT / _HERE)
+    log(f"[INFO] Repo root: {_REPO_ROOT}")
+    log(f"[INFO] Wrapper dir: {_HERE}")
     
     # ========== STEP 2: CHANGE WORKING DIRECTORY ==========
     # Ensure all relative paths in app.py work (e.g., ./db, ./assets, ./backend)
+    # Skipped when already there (e.g. `streamlit run ui/streamlit_app.py` from the repo root)
     try:
-        os.chdir(REPO_ROOT)
-        print(f"[INFO] Working directory set to: {os.getcwd()}")
+        cwd = os.getcwd()
+        if cwd != _REPO_ROOT and os.path.realpath(cwd) != os.path.realpath(_REPO_ROOT):
+            os.chdir(_REPO_ROOT)
+            log(f"[INFO] Working directory set to: {_REPO_ROOT}")
+        else:
+            log(f"[INFO] Working directory already: {cwd}")
     except Exception as e:
-        print(f"[ERROR] Failed to change working directory to {REPO_ROOT}: {e}")
+        print(f"[ERROR] Failed to change working directory to {_REPO_ROOT}: {e}")
         traceback.print_exc()
         raise
     
     # ========== STEP 3: SET UP sys.path ==========
     # Ensure repo root and backend are importable
-    if str(REPO_ROOT) not in sys.path:
-        sys.path.insert(0, str(REPO_ROOT))
-    if str(REPO_ROOT / "backend") not in sys.path:
-        sys.path.insert(0, str(REPO_ROOT / "backend"))
+    path_set = set(sys.path)
+    if _REPO_ROOT not in path_set:
+        sys.path.insert(0, _REPO_ROOT)
+    if _BACKEND_DIR not in path_set:
+        sys.path.insert(0, _BACKEND_DIR)
     
-    print(f"[INFO] sys.path updated. Top entries:")
-    for i, p in enumerate(sys.path[:3]):
-        print(f"        {i}: {p}")
+    install_backend_finder()
+    warm_backend_bytecode()
+    
+    if WRAPPER_DEBUG:
+        print("[INFO] sys.path updated. Top entries:")
+        for i, p in enumerate(sys.path[:3]):
+            print(f"        {i}: {p}")
     
     # ========== STEP 4: LOAD SECRETS & ENVIRONMENT ==========
     # Priority: Streamlit secrets > .env file > os.environ
     
-    # Try to load Streamlit secrets (available on Streamlit Cloud)
-    secrets_loaded = False
+    # Secrets are read on a worker thread while the main thread loads app.py's code
+    secrets_result = {}
+    secrets_thread = threading.Thread(
+        target=lambda: secrets_result.update(loaded=load_streamlit_secrets()), daemon=True
+    )
+    secrets_thread.start()
     try:
-        import streamlit as st
-        if hasattr(st, 'secrets') and st.secrets:
-            print("[INFO] Streamlit secrets detected. Loading into os.environ...")
-            for key, value in st.secrets.items():
-                os.environ[key] = str(value)
-            secrets_loaded = True
-            print(f"[INFO] Loaded {len(st.secrets)} secret(s) from Streamlit")
-    except Exception as e:
-        print(f"[DEBUG] Streamlit secrets not available (expected locally): {e}")
+        app_code = load_app_code(_APP_FILE)
+    except Exception:
+        app_code = None  # loaded again (and the error reported) in step 6
+    secrets_thread.join()
+    secrets_loaded = secrets_result.get("loaded", False)
     
-    # Fall back to .env file if python-dotenv is available
-    if not secrets_loaded:
-        env_file = REPO_ROOT / ".env"
-        if env_file.exists():
+    # Fall back to .env file if python-dotenv is available;
+    # Streamlit Cloud deployments configure secrets instead, so it isn't probed there
+    if not secrets_loaded and not _ON_STREAMLIT_CLOUD:
+        if os.path.exists(_ENV_FILE):
             try:
                 from dotenv import load_dotenv
-                load_dotenv(env_file)
-                print(f"[INFO] Loaded .env from {env_file}")
+                load_dotenv(_ENV_FILE)
+                log(f"[INFO] Loaded .env from {_ENV_FILE}")
             except ImportError:
-                print(f"[DEBUG] python-dotenv not installed; .env will not be loaded")
+                log("[DEBUG] python-dotenv not installed; .env will not be loaded")
             except Exception as e:
                 print(f"[WARNING] Failed to load .env: {e}")
         else:
-            print(f"[DEBUG] No .env file found at {env_file}")
+            log(f"[DEBUG] No .env file found at {_ENV_FILE}")
     
     # ========== STEP 5: VERIFY ENVIRONMENT ==========
-    gemini_key = os.environ.get("GEMINI_API_KEY")
+    gemini_key = os.environ.get(GEMINI_KEY_ENV_VAR)
     if gemini_key:
-        print(f"[INFO] GEMINI_API_KEY is set (length: {len(gemini_key)})")
+        log(f"[INFO] GEMINI_API_KEY is set (length: {len(gemini_key)})")
     else:
         print("[WARNING] GEMINI_API_KEY not set in environment. Backend may fail if used.")
     
     # ========== STEP 6: EXECUTE app.py ==========
-    app_file = REPO_ROOT / "app.py"
-    
-    if not app_file.exists():
-        print(f"[ERROR] app.py not found at {app_file}")
-        print(f"[DEBUG] Contents of {REPO_ROOT}:")
+    # No separate exists() check: loading app.py raises FileNotFoundError itself
+    try:
+        code = app_code if app_code is not None else load_app_code(_APP_FILE)
+    except FileNotFoundError:
+        print(f"[ERROR] app.py not found at {_APP_FILE}")
+        print(f"[DEBUG] Contents of {_REPO_ROOT} (first 10 entries):")
         try:
-            for item in sorted(REPO_ROOT.iterdir())[:10]:
-                print(f"        {item.name}")
+            # Stop after 10 entries instead of listing and sorting the whole directory
+            with os.scandir(_REPO_ROOT) as entries:
+                names = sorted(entry.name for entry in itertools.islice(entries, 10))
+            for name in names:
+                print(f"        {name}")
         except Exception as e:
             print(f"        (error listing: {e})")
-        raise FileNotFoundError(f"app.py not found at {app_file}")
+        raise FileNotFoundError(f"app.py not found at {_APP_FILE}") from None
+    except Exception as e:
+        _print_app_failure(e)
+        raise
     
-    print(f"[INFO] Executing {app_file} with __main__ semantics...")
+    log(f"[INFO] Executing {_APP_FILE} with __main__ semantics...")
     
     try:
-        # Use runpy.run_path to execute app.py as if run by the Python interpreter
-        # This ensures __name__ == "__main__" and all module-level code runs
-        runpy.run_path(str(app_file), run_name="__main__")
+        # Execute app.py's code as if run by the Python interpreter
+        # This ensures __name__ == "__main__" and all module-level code runs.
+        # The module comes straight from a file spec (with __file__, __spec__ and
+        # __loader__ set) and is __main__ while it runs, as runpy would arrange
+        spec = importlib.util.spec_from_file_location("__main__", _APP_FILE)
+        app_module = importlib.util.module_from_spec(spec)
+        previous_main = sys.modules.get("__main__")
+        sys.modules["__main__"] = app_module
+        try:
+            exec(code, app_module.__dict__)
+        finally:
+            if previous_main is not None:
+                sys.modules["__main__"] = previous_main
     except Exception as e:
-        print(f"\n[ERROR] Exception occurred while executing app.py:")
-        print(f"{type(e).__name__}: {e}")
-        traceback.print_exc()
-        
-        # Print diagnostic info
-        print(f"\n[DIAGNOSTICS]")
-        print(f"  REPO_ROOT: {REPO_ROOT}")
-        print(f"  Working directory: {os.getcwd()}")
-        print(f"  app.py exists: {app_file.exists()}")
-        print(f"  backend/ exists: {(REPO_ROOT / 'backend').exists()}")
-        print(f"  sys.path (first 3):")
-        for i, p in enumerate(sys.path[:3]):
-            print(f"    {i}: {p}")
-        
+        _print_app_failure(e)
         raise
 
 
+def _print_app_failure(e: Exception) -> None:
+    """Print the exception raised while loading or executing app.py, plus diagnostics."""
+    print("\n[ERROR] Exception occurred while executing app.py:")
+    print(f"{type(e).__name__}: {e}")
+    traceback.print_exc()
+    
+    # Print diagnostic info
+    print("\n[DIAGNOSTICS]")
+    print(f"  REPO_ROOT: {_REPO_ROOT}")
+    print(f"  Working directory: {os.getcwd()}")
+    print(f"  app.py exists: {os.path.exists(_APP_FILE)}")
+    print(f"  backend/ exists: {os.path.exists(_BACKEND_DIR)}")
+    print("  sys.path (first 3):")
+    for i, p in enumerate(sys.path[:3]):
+        print(f"    {i}: {p}")
+
+
+# Kept for programmatic callers of the old name
+setup_environment_and_run = _setup
+
+
 if __name__ == "__main__":
-    setup_environment_and_run()
+    _setup()
 